@@ -1,112 +1,378 @@
 #!/usr/bin/env python3
+import atexit
+import collections
 import select
+import shutil
+import signal
 import sys
+import tempfile
 import os
+import threading
 import time
+import traceback
 
 import pyfanotify as fan
-import multiprocessing as mp
 
+_SHM_DIR = '/dev/shm'
+_START_TIMEOUT = 10
+_STOP_TIMEOUT = 5
 
-def run():
+
+def _make_waiter(fd):
+    """
+    Create an epoll object waiting for input on `fd`.
+    fanotify is Linux-only, so epoll is always available here.
+    """
+    ep = select.epoll()
+    ep.register(fd, select.EPOLLIN)
+    return ep
+
+
+def _close_fds(fds):
+    """
+    Close `fds` with one closerange() per run of consecutive descriptors.
+    os.closerange() uses close_range(2) where the kernel supports it.
+    """
+    fds = sorted(fds)
+    i = 0
+    while i < len(fds):
+        j = i
+        while j + 1 < len(fds) and fds[j + 1] == fds[j] + 1:
+            j += 1
+        if i == j:
+            os.close(fds[i])
+        else:
+            os.closerange(fds[i], fds[j] + 1)
+        i = j + 1
+
+
+class _EventLog:
+    """
+    Ring buffer of event records printed by a background thread, so the
+    event loop never blocks on stdout before answering permission events.
+    When the printer falls behind, the oldest records are dropped.
+    """
+
+    def __init__(self, maxlen=8192):
+        self._records = collections.deque(maxlen=maxlen)
+        self._ready = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='EventLog', daemon=True)
+        self._thread.start()
+
+    def append(self, record):
+        self._records.append(record)
+
+    def flush(self):
+        self._ready.set()
+
+    def close(self):
+        self._stopped = True
+        self._ready.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped:
+            self._ready.wait()
+            self._ready.clear()
+            self._print()
+        self._print()
+
+    def _print(self):
+        records = self._records
+        while records:
+            ts, ev_types, pid, path, fd, original_fd = records.popleft()
+            print(f"Permission event: {fan.evt_to_str(ev_types)}")
+            print(f"  Time: {ts / 1e9:.6f}")
+            print(f"  PID: {pid}")
+            print(f"  Path: {path}")
+            print(f"  FD: {fd}")
+            print(f"  Original FD: {original_fd}")
+            print()
+        sys.stdout.flush()
+
+
+class _Decider:
+    """
+    Answers the events handed over by the reading loop in its own thread.
+    The deque is the only thing shared: the reader appends, the decider
+    pops.
+
+    A decision is reused for the same process, event type and file for
+    `window` seconds, so bursts of repeated opens (stat-open-close loops)
+    are answered without running the policy or logging them again.
+    """
+
+    def __init__(self, cli, events_log, window=0.05):
+        self._cli = cli
+        self._events_log = events_log
+        self._window = window
+        self._recent = {}
+        self._purge_at = 0
+        self._pending = collections.deque()
+        self._ready = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='Decider', daemon=True)
+        self._thread.start()
+
+    def extend(self, events):
+        self._pending.extend(events)
+        self._ready.set()
+
+    def close(self):
+        self._stopped = True
+        self._ready.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped:
+            self._ready.wait()
+            self._ready.clear()
+            self._try_decide()
+        self._try_decide()
+
+    def _try_decide(self):
+        # The reader keeps handing events over: this thread must not die,
+        # or every later permission event would stay unanswered
+        try:
+            self._decide()
+        except Exception:
+            traceback.print_exc()
+            if self._pending:
+                self._ready.set()
+
+    def _decide(self):
+        # Runs for every batch: bind what the loop body uses to locals and
+        # read FanotifyData items directly instead of via __getattr__
+        pending_pop = self._pending.popleft
+        log_append = self._events_log.append
+        fsdecode = os.fsdecode
+        readlink = os.readlink
+        fstat = os.fstat
+        now_ns = time.monotonic_ns
+        monotonic = time.monotonic
+        all_perm = fan.FAN_ALL_PERM_EVENTS
+        allow = fan.FAN_ALLOW
+        recent = self._recent
+        window = self._window
+        # New events keep arriving while a pass runs: take only those pending
+        # at its start, so a steady stream can't hold back the responses
+        while self._pending:
+            now = monotonic()
+            if now >= self._purge_at:
+                for key in [k for k, (exp, _) in recent.items() if exp <= now]:
+                    del recent[key]
+                self._purge_at = now + 1
+            # Answer what is pending now with one writev()
+            resps = []
+            fds = []
+            resps_append = resps.append
+            fds_append = fds.append
+            for _ in range(len(self._pending)):
+                event = pending_pop()
+                # A pass can take a while (readlink, fstat): a key must not
+                # outlive its window because `now` was read at the start
+                now = monotonic()
+                ev_types = event['ev_types']
+                fd = event['fd']
+                original_fd = event['original_fd']
+                # The monitor already resolved the path to match `path_pattern`;
+                # only fall back to the file descriptor if it was not sent
+                path = event['path']
+                if path:
+                    key = (event['pid'], ev_types, path[0])
+                else:
+                    try:
+                        st = fstat(fd)
+                        key = (event['pid'], ev_types, st.st_dev, st.st_ino)
+                    except OSError:
+                        key = None
+            
+                hit = recent.get(key)
+                if hit and hit[0] > now:
+                    response_action = hit[1]
+                else:
+                    if path:
+                        path = fsdecode(path[0])
+                    else:
+                        try:
+                            path = readlink(f"/proc/self/fd/{fd}")
+                        except OSError:
+                            path = "unknown"
+                
+                    log_append((now_ns(), ev_types, event['pid'], path, fd, original_fd))
+                
+                    # Decide whether to allow or deny the operation
+                    # For this example, we'll allow all operations
+                    # You could implement custom logic here
+                    response_action = allow
+                    if key:
+                        recent[key] = (now + window, response_action)
+            
+                if ev_types & all_perm:
+                    resps_append((original_fd, response_action))
+                    # no fd is passed when the monitor can't get one (e.g. fd exhaustion)
+                    if fd >= 0:
+                        fds_append(fd)
+
+            if resps:
+                try:
+                    # Send responses to allow the operations
+                    self._cli.response_batch(resps)
+                except Exception as e:
+                    print(f"Error sending responses: {e}")
+                finally:
+                    # Always close the file descriptors
+                    _close_fds(fds)
+        
+            # Print the records only after the events are answered
+            self._events_log.flush()
+
+
+def run(log_only=False, ready_fd=None):
+    """
+    :param log_only: only log file opens, never deny them. Blocking PERM
+        events are only needed when an operation may be denied; plain
+        FAN_OPEN/FAN_OPEN_EXEC events don't hold the opening process until
+        a response is written, and no event fd has to be passed and closed.
+    :param ready_fd: if set, a byte is written to it and it is closed once
+        the monitor is armed
+    """
     if os.geteuid() != 0:
         print("Error: Permission events require root privileges")
         sys.exit(1)
 
-    # Create a test directory
-    test_dir = "/home"
+    # Create a test directory. Marking only this directory keeps other
+    # processes' opens out of the permission path, and tmpfs makes
+    # creating and removing it a memory-only operation
+    test_dir = tempfile.mkdtemp(prefix='pyfanotify-', dir=_SHM_DIR if os.path.isdir(_SHM_DIR) else None)
+    atexit.register(shutil.rmtree, test_dir, ignore_errors=True)
     
     print(f"Monitoring permission events on: {test_dir}")
     print("Try accessing files in this directory from another terminal")
     print("Press Ctrl+C to stop")
     
-    # Initialize fanotify without FID support (required for permission events)
+    # Initialize fanotify without FID support (required for permission events).
+    # The group always gets an unlimited event queue (FAN_UNLIMITED_QUEUE),
+    # so a burst of events can't overflow it while responses are pending;
+    # events dropped on overflow would be allowed without asking us
     fanot = fan.Fanotify(init_fid=False)
     
     # Mark the test directory for permission events
     # We'll monitor open and access permission events
-    perm_events = fan.FAN_OPEN_PERM | fan.FAN_ACCESS_PERM | fan.FAN_OPEN_EXEC_PERM
-    fanot.mark(test_dir, ev_types=perm_events, is_type='fs')
+    if log_only:
+        ev_types = fan.FAN_OPEN | fan.FAN_OPEN_EXEC
+    else:
+        ev_types = fan.FAN_OPEN_PERM | fan.FAN_ACCESS_PERM | fan.FAN_OPEN_EXEC_PERM
+    fanot.mark(test_dir, ev_types=ev_types | fan.FAN_EVENT_ON_CHILD, is_type='dir')
     fanot.start()
 
     # Create a client to receive events
     # pass_fd=True is required to get file descriptors for permission responses
-    cli = fan.FanotifyClient(fanot, path_pattern='*', pass_fd=True)
+    cli = fan.FanotifyClient(fanot, path_pattern='*', pass_fd=not log_only)
+    
+    ep = _make_waiter(cli.sock.fileno())
+    events_log = _EventLog()
     
-    poll = select.poll()
-    poll.register(cli.sock.fileno(), select.POLLIN)
+    decider = _Decider(cli, events_log)
+    
+    if ready_fd is not None:
+        os.write(ready_fd, b'\0')
+        os.close(ready_fd)
     
     try:
-        while poll.poll():
-            for event in cli.get_events():
-                event_str = fan.evt_to_str(event.ev_types)
-                # Get path from file descriptor instead of event struct
-                try:
-                    path = os.readlink(f"/proc/self/fd/{event.fd}")
-                except (OSError, FileNotFoundError):
-                    path = "unknown"
-                
-                print(f"Permission event: {event_str}")
-                print(f"  PID: {event.pid}")
-                print(f"  Path: {path}")
-                print(f"  FD: {event.fd}")
-                print(f"  Original FD: {event.original_fd}")
-                
-                # Decide whether to allow or deny the operation
-                # For this example, we'll allow all operations
-                # You could implement custom logic here
-                response_action = fan.FAN_ALLOW
-                
-                if event.ev_types & fan.FAN_ALL_PERM_EVENTS:
-                    try:
-                        # Send response to allow the operation
-                        cli.response(event.original_fd, response_action)
-                        print(f"  Response: ALLOWED")
-                    except Exception as e:
-                        print(f"  Error sending response: {e}")
-                    finally:
-                        # Always close the file descriptor
-                        os.close(event.fd)
-                
-                print()
+        # Only read here: answering happens in the decider thread, so a
+        # slow response never stops the socket from being drained
+        while ep.poll():
+            decider.extend(cli.get_events())
                 
     except KeyboardInterrupt:
         print("\nStopping...")
     finally:
-        cli.close()
-        fanot.stop()
+        try:
+            decider.close()
+            events_log.close()
+            ep.close()
+            # On Ctrl+C the Fanotify process may already be gone, and these
+            # raise BrokenPipeError
+            cli.close()
+            fanot.stop()
+        finally:
+            # atexit handlers don't run in the forked monitor (os._exit)
+            shutil.rmtree(test_dir, ignore_errors=True)
 
-def run_monitor_in_seperate_process():
+def run_monitor_in_seperate_process(log_only=False):
     """
     We need to run the monitor in a seperate process to avoid deadlock.
+    A plain fork() is enough: the child inherits the imported modules and
+    doesn't need the multiprocessing bootstrap.
     """
-    process = None
+    pid = 0
+    rd, wr = os.pipe()
     try:
-        process = mp.Process(target=run, args=())
-        process.start()
+        pid = os.fork()
+        if not pid:
+            os.close(rd)
+            code = 1
+            try:
+                run(log_only, wr)
+                code = 0
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        os.close(wr)
+        wr = -1
         
-        # Give it time to start
-        time.sleep(2)
+        # Wait until the monitor is armed; EOF means it exited before that
+        ready = select.select([rd], [], [], _START_TIMEOUT)[0] and os.read(rd, 1)
         
-        if process.is_alive():
-            process.join(timeout=None)
+        if ready:
+            try:
+                _, status = os.waitpid(pid, 0)
+            except KeyboardInterrupt:
+                # Ctrl+C reaches the monitor too: give it time to clean up
+                # before it gets SIGTERM below
+                deadline = time.monotonic() + _STOP_TIMEOUT
+                while time.monotonic() < deadline:
+                    try:
+                        done = os.waitpid(pid, os.WNOHANG)[0]
+                    except ChildProcessError:
+                        # already reaped by the interrupted waitpid() above
+                        done = True
+                    if done:
+                        pid = 0
+                        break
+                    time.sleep(0.1)
+                raise
+            pid = 0
+            if os.WIFEXITED(status):
+                exitcode = os.WEXITSTATUS(status)
+            else:
+                exitcode = -os.WTERMSIG(status)
             
-            if process.exitcode == 0:
+            if exitcode == 0:
                 print("✓ Separate process approach worked!")
             else:
-                print(f"✗ Process failed with exit code: {process.exitcode}")
+                print(f"✗ Process failed with exit code: {exitcode}")
         else:
             print("✗ Monitoring process failed to start")
             
     except Exception as e:
         print(f"✗ Error: {e}")
     finally:
-        try:
-            if process and process.is_alive():
-                process.terminate()
-                process.join(timeout=5)
-        except:
-            pass
+        os.close(rd)
+        if wr != -1:
+            os.close(wr)
+        if pid:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
 
 if __name__ == '__main__':
-    run_monitor_in_seperate_process()
+    run_monitor_in_seperate_process(log_only='--log-only' in sys.argv[1:])
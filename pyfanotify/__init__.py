@@ -139,6 +139,11 @@ _EVT_MASKS = {
 class Fanotify(mp.Process):
     """
     Wrapper for Linux fanotify. Runs in a new process.
+
+    The fanotify group is created with FAN_UNLIMITED_QUEUE and
+    FAN_UNLIMITED_MARKS, so a slow consumer does not overflow the event
+    queue. On overflow the kernel drops the event, so a permission event
+    would be allowed without asking the listener, bypassing the policy.
     """
 
     def __init__(self, init_fid: bool = False, log: logging.Logger = None,
@@ -373,6 +378,22 @@ class Fanotify(mp.Process):
     def response(self, event_fd: int, response: int) -> None:
         return ext.response(self._ctx, self._fd, event_fd, response, sys.stdout.fileno())
 
+    def response_batch(self, responses: Iterable[Tuple[int, int]]) -> None:
+        """
+        Send responses to several permission events with one writev(2) per
+        64 responses. The fanotify fd handles each iovec as a separate write,
+        so every `(event_fd, response)` pair is delivered as its own
+        `struct fanotify_response`. A response that fails to write is
+        skipped and the rest are still sent.
+
+        :param responses: pairs of `(event_fd, response)`
+        :raises OSError: if any response failed to write
+        :raises TypeError: if a response is not an `(event_fd, response)` pair
+        :raises ValueError: if invalid response value
+        """
+
+        return ext.response_batch(self._ctx, self._fd, responses, sys.stdout.fileno())
+
     def _close(self) -> None:
         self._rd.close()
         self._rd = None
@@ -458,7 +479,7 @@ class FanotifyClient:
     Client for easy use and getting data via Fanotify.
     """
 
-    _PID_EVT_ORIG_FD_S = struct.Struct('=qQi')
+    _PID_EVT_ORIG_FD_S = struct.Struct('=qQi4x')  # matches the explicitly padded C struct
     _P_SZ_S = struct.Struct('=I')
 
     def __init__(self, fanotify: Fanotify, **rkw) -> None:
@@ -485,6 +506,25 @@ class FanotifyClient:
         self.fanotify.response(event_fd, response)
         self.fanotify.close_fd(event_fd)
 
+    def response_batch(self, responses: Iterable[Tuple[int, int]]) -> None:
+        """
+        Send responses to several permission events at once.
+        See :meth:`Fanotify.response_batch`
+
+        NOTE: event fds will be closed automatically after the response,
+        also when some responses failed to write. They are left open if
+        `responses` is rejected before anything is written.
+        """
+        responses = tuple(responses)
+        try:
+            self.fanotify.response_batch(responses)
+        except OSError:
+            for event_fd, _ in responses:
+                self.fanotify.close_fd(event_fd)
+            raise
+        for event_fd, _ in responses:
+            self.fanotify.close_fd(event_fd)
+
     def close(self) -> None:
         """
         Close the connection to the Fanotify object. The data will no
@@ -500,9 +540,10 @@ class FanotifyClient:
         for the current client.
         """
 
+        recv_data = self._recv_data
         while 1:
             try:
-                data = self._recv_data()
+                data = recv_data()
             except (socket.error, OSError):
                 break
             if not data:
@@ -513,43 +554,50 @@ class FanotifyClient:
         msg, anc, flags, addr = self.sock.recvmsg(8192, 4096, socket.MSG_DONTWAIT)
         if not msg:
             return
+        # called for every event: keep lookups local and set items directly
+        # instead of going through FanotifyData.__setattr__
         res = FanotifyData()
         for level, ty, fd in anc:
             if level == socket.SOL_SOCKET and ty == socket.SCM_RIGHTS:
                 fds = array.array('i')
                 fds.frombytes(fd)
-                res.fd = fds[0]
-        
+                res['fd'] = fds[0]
+
+        msg_len = len(msg)
+        head_s = self._PID_EVT_ORIG_FD_S
+        sz_unpack_from = self._P_SZ_S.unpack_from
+        sz_size = self._P_SZ_S.size
+
         # Check if we have enough data for the initial struct
-        if len(msg) < self._PID_EVT_ORIG_FD_S.size:
+        if msg_len < head_s.size:
             return res
             
-        res.pid, res.ev_types, res.original_fd = self._PID_EVT_ORIG_FD_S.unpack_from(msg, 0)
-        off = self._PID_EVT_ORIG_FD_S.size
+        res['pid'], res['ev_types'], res['original_fd'] = head_s.unpack_from(msg, 0)
+        off = head_s.size
         
         for i in 'exe', 'cwd':
             # Check if we have enough data for the size field
-            if off + self._P_SZ_S.size > len(msg):
+            if off + sz_size > msg_len:
                 break
-            sz, = self._P_SZ_S.unpack_from(msg, off)
-            off += self._P_SZ_S.size
+            sz, = sz_unpack_from(msg, off)
+            off += sz_size
             
             # Check if we have enough data for the actual content
-            if off + sz > len(msg):
+            if off + sz > msg_len:
                 break
             res[i] = msg[off:off + sz]
             off += sz
             
         p = []
-        while off < len(msg):
+        while off < msg_len:
             # Check if we have enough data for the size field
-            if off + self._P_SZ_S.size > len(msg):
+            if off + sz_size > msg_len:
                 break
-            sz, = self._P_SZ_S.unpack_from(msg, off)
-            off += self._P_SZ_S.size
+            sz, = sz_unpack_from(msg, off)
+            off += sz_size
             
             # Check if we have enough data for the actual content
-            if off + sz > len(msg):
+            if off + sz > msg_len:
                 break
             p.append(msg[off:off + sz])
             off += sz
@@ -557,5 +605,17 @@ class FanotifyClient:
         return res
 
 
-def evt_to_str(evt: int):
+def _evt_to_str(evt: int) -> str:
     return '|'.join(v for k, v in _EVT_MASKS.items() if k & evt)
+
+
+# the same few masks repeat on every event
+_EVT_STR = {evt: _evt_to_str(evt) for evt in _EVT_MASKS}
+
+
+def evt_to_str(evt: int) -> str:
+    try:
+        return _EVT_STR[evt]
+    except KeyError:
+        s = _EVT_STR[evt] = _evt_to_str(evt)
+        return s
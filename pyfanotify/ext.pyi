@@ -157,6 +157,24 @@ def response(ctx: int, fanotify_fd: int, event_fd: int, response: int, log_fd: i
     """
     ...
 
+def response_batch(ctx: int, fanotify_fd: int, responses: Iterable[Tuple[int, int]], log_fd: int = -1) -> None:
+    """
+    Send responses to several permission events. Responses are written
+    with writev(), one iovec per struct fanotify_response. All responses are
+    validated before anything is written; a response that fails to write is
+    skipped and the rest are still sent.
+
+    Args:
+        fanotify_fd (int): Fanotify file descriptor (from fanotify_init)
+        responses (Iterable[Tuple[int, int]]): Pairs of (event_fd, response)
+
+    Raises:
+        OSError: if any response failed to write (after sending the others)
+        TypeError: if a response is not an (event_fd, response) pair
+        ValueError: if invalid response value
+    """
+    ...
+
 
 class FanoRule:
     """
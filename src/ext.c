@@ -15,6 +15,7 @@
 #include <string.h>
 #include <sys/fanotify.h>
 #include <sys/socket.h>
+#include <sys/uio.h>
 #include <sys/un.h>
 #include <sys/vfs.h>
 #include <unistd.h>
@@ -42,6 +43,10 @@ PyDoc_STRVAR(ext__doc__,
 
 #define O_FLAGS (O_RDONLY|O_LARGEFILE|O_CLOEXEC|O_NOATIME)
 #define PID_CACHE_SIZE 64
+#define RESPONSE_BATCH_SIZE 64
+#define POLL_TIMEOUT_MS 1000
+#define HANDLE_EVENTS_READS 8
+#define PROC_FD_FMT(ctx) (((ctx)->proc_fd_dir != -1) ? "%d" : "/proc/self/fd/%d")
 
 enum RUN_ERR_CODE {
     PY_FILLED_ERR = -100,
@@ -69,6 +74,8 @@ typedef struct {
     pending_fd_t *pending_fds;
     long main_pid;
     int fano_fd;
+    int fano_nonblock;
+    int proc_fd_dir;
     int log_fd;
     int sock_fd;
 } fano_ctx_t;
@@ -494,7 +501,7 @@ pyfanotify_create(PyObject *self, PyObject *args, PyObject *kwargs)
     if (!ctx)
         return PyErr_SetFromErrno(PyExc_OSError);
 
-    ctx->fano_fd = ctx->log_fd = ctx->sock_fd = -1;
+    ctx->fano_fd = ctx->log_fd = ctx->sock_fd = ctx->proc_fd_dir = -1;
     ctx->cache_idx = ctx->pid_cache;
     ctx->main_pid = getpid();
     ctx->pending_fds = NULL;
@@ -538,6 +545,7 @@ pyfanotify_init(PyObject *self, PyObject *args, PyObject *kwargs)
     ctx->fano_fd = fanotify_init(flags, o_flags);
     if (ctx->fano_fd == -1)
         return PyErr_SetFromErrno(PyExc_OSError);
+    ctx->fano_nonblock = !!(flags & FAN_NONBLOCK);
 
     return PyLong_FromLong(ctx->fano_fd);
 }
@@ -652,12 +660,12 @@ send_permission_response(fano_ctx_t *ctx, struct fanotify_event_metadata *ev)
 }
 
 static ssize_t
-get_proc_str(const char *fmt, int meta, char *buf, size_t buf_size)
+get_proc_str(int dirfd, const char *fmt, int meta, char *buf, size_t buf_size)
 {
     ssize_t path_len;
     char pathname[32];
     snprintf(pathname, sizeof(pathname) - 1, fmt, meta);
-    if ((path_len = readlink(pathname, buf, buf_size - 1)) < 0)
+    if ((path_len = readlinkat(dirfd, pathname, buf, buf_size - 1)) < 0)
         return 0;
     buf[path_len] = '\0';
     return path_len;
@@ -734,9 +742,12 @@ handle_events(fano_ctx_t *ctx)
     struct fanotify_event_metadata buf[256];
     ssize_t len;
     buffer_t bb = BUFFER_INIT;
-    int ret = 0;
+    int ret = 0, reads = 0;
 
+again:
     if ((len = read(ctx->fano_fd, buf, sizeof(buf))) == -1) {
+        if (reads && AGAIN)     // queue is drained
+            goto end;
         ret = errno;
         do_log(ctx, "ERROR: Failed to read from fanotify fd: %s", strerror(errno));
         goto end;
@@ -857,7 +868,7 @@ handle_events(fano_ctx_t *ctx)
                     ev->fd = dfd;
                 if (fnames && ev->fd == dfd) {
                     for (int i = 0; i < fnames; ++i) {
-                        path[i].len = (dfd >= 0) ? get_proc_str("/proc/self/fd/%d", dfd, path[i].buf, sizeof(path[i].buf)) : 0;
+                        path[i].len = (dfd >= 0) ? get_proc_str(ctx->proc_fd_dir, PROC_FD_FMT(ctx), dfd, path[i].buf, sizeof(path[i].buf)) : 0;
                         path[i].buf[path[i].len] = '/';
                         path[i].len = stpncpy(path[i].buf + path[i].len + 1, file_name[i], sizeof(path[i].buf) - path[i].len - 1) - path[i].buf;
                     }
@@ -877,30 +888,37 @@ handle_events(fano_ctx_t *ctx)
         int rule_matched = 0;  // Flag to track if any rule matched
         for (c_rule_t *rule = ctx->rules; rule; rule = rule->next) {
 
-# define RULE_MATCH(name, fmt, meta, i)     \
+// "*" matches any string: skip fnmatch() for it
+# define PATTERN_ANY(p) ((p).buf[0] == '*' && !(p).buf[1])
+# define RULE_MATCH(name, dirfd, fmt, meta, i)   \
         (rule->name##_pattern.len           \
             && (!(((name)[i]).buf[0]        \
-                    || (((name)[i]).len = get_proc_str(fmt, ev->meta, ((name)[i]).buf, sizeof(((name)[i]).buf))))  \
-                || fnmatch(rule->name##_pattern.buf, ((name)[i]).buf, FNM_EXTMATCH)))
+                    || (((name)[i]).len = get_proc_str(dirfd, fmt, ev->meta, ((name)[i]).buf, sizeof(((name)[i]).buf))))  \
+                || (!PATTERN_ANY(rule->name##_pattern)  \
+                    && fnmatch(rule->name##_pattern.buf, ((name)[i]).buf, FNM_EXTMATCH))))
 
             if (rule_pids_check(rule, ev->pid)
                     || (rule->ev_types && !(rule->ev_types & ev->mask))
-                    || RULE_MATCH(exe, "/proc/%ld/exe", pid, 0)
-                    || RULE_MATCH(cwd, "/proc/%ld/cwd", pid, 0)
-                    || RULE_MATCH(path, "/proc/self/fd/%ld", fd, 0)
-                    || RULE_MATCH(path, "/proc/self/fd/%ld", fd, 1)) {
+                    || RULE_MATCH(exe, AT_FDCWD, "/proc/%d/exe", pid, 0)
+                    || RULE_MATCH(cwd, AT_FDCWD, "/proc/%d/cwd", pid, 0)
+                    || RULE_MATCH(path, ctx->proc_fd_dir, PROC_FD_FMT(ctx), fd, 0)
+                    // without file names both paths come from the same fd: don't readlink it twice
+                    || (fnames && RULE_MATCH(path, ctx->proc_fd_dir, PROC_FD_FMT(ctx), fd, 1))) {
                 continue;
             }
 # undef RULE_MATCH
+# undef PATTERN_ANY
 
             rule_matched = 1;  // At least one rule matched
 
             // sending data
+            // explicit padding: the wire size must not depend on the arch's int64_t alignment
             struct {
                 int64_t pid;
                 uint64_t ev_types;
                 int32_t original_fd;
-            } data = {ev->pid, ev->mask, ev->fd};
+                int32_t _pad;
+            } data = {ev->pid, ev->mask, ev->fd, 0};
             struct iovec iov[] = {
                     {&data, sizeof(data)},
                     {exe,  exe[0].len + sizeof(exe[0].len)},
@@ -968,6 +986,10 @@ handle_events(fano_ctx_t *ctx)
             close(ev->fd);
         }
     }
+    // keep reading while events are queued, but return to poll() now and
+    // then so that commands (e.g. CMD_CLOSE_FD) are not starved
+    if (ctx->fano_nonblock && ++reads < HANDLE_EVENTS_READS)
+        goto again;
 end:
     free(bb.buf);
     return ret;
@@ -1003,6 +1025,14 @@ PyDoc_STRVAR(run__doc__,
 "    AssertionError: When fanotify metadata version is mismatch\n"
 "    OSError: Some errors\n");
 
+static long long
+monotonic_ms(void)
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec * 1000LL + ts.tv_nsec / 1000000;
+}
+
 static PyObject *
 pyfanotify_run(PyObject *self, PyObject *args, PyObject *kwargs)
 {
@@ -1074,25 +1104,29 @@ pyfanotify_run(PyObject *self, PyObject *args, PyObject *kwargs)
         goto end;
     }
 
-    time_t fn_timer = 0;
+    // resolve event fds relative to our own fd directory instead of walking
+    // "/proc/self/fd/N" each time; the absolute path is kept as a fallback
+    ctx->proc_fd_dir = open("/proc/self/fd", O_PATH | O_DIRECTORY | O_CLOEXEC);
+
+    long long fn_deadline = 0;
     PyThreadState *state = PyEval_SaveThread();
     while (ppid == getppid()) {
-        do {
-            if (ctx->rules && fn) {
-                if (fn_timeout) {
-                    time_t tmp_time = time(0);
-                    if (tmp_time - fn_timer < fn_timeout)
-                        break;
-                    fn_timer = tmp_time;
-                }
+        // wake up no later than the next fn call is due
+        int poll_timeout = POLL_TIMEOUT_MS;
+        if (ctx->rules && fn) {
+            long long now = monotonic_ms();
+            if (now >= fn_deadline) {
+                fn_deadline = now + fn_timeout * 1000LL;
                 PyEval_RestoreThread(state);
                 Py_DecRef(PyObject_Call(fn, fn_args, 0));
                 PyErr_Clear();
                 state = PyEval_SaveThread();
             }
-        } while (0);
+            if (fn_timeout && fn_deadline - now < poll_timeout)
+                poll_timeout = (int)(fn_deadline - now);
+        }
 
-        int rdy = poll(fds, sizeof(fds) / sizeof(*fds), 1000);
+        int rdy = poll(fds, sizeof(fds) / sizeof(*fds), poll_timeout);
         if (rdy < 0) {
             if (errno == EINTR)
                 continue;
@@ -1137,7 +1171,7 @@ pyfanotify_run(PyObject *self, PyObject *args, PyObject *kwargs)
 
             state = PyEval_SaveThread();
             if (!old && ctx->rules)
-                fn_timer = 0;
+                fn_deadline = 0;
             else if (old && !ctx->rules) {   // flush
                 fanotify_mark(ctx->fano_fd, FAN_MARK_FLUSH, 0, AT_FDCWD, 0);
                 fanotify_mark(ctx->fano_fd, FAN_MARK_FLUSH | FAN_MARK_MOUNT, 0, AT_FDCWD, 0);
@@ -1162,6 +1196,8 @@ end:
     if (dup2(1, ctx->fano_fd) == -1)
         close(ctx->fano_fd);
     close(ctx->sock_fd);
+    if (ctx->proc_fd_dir != -1)
+        close(ctx->proc_fd_dir);
     rules_list_clear(&ctx->rules);
     fs_list_clear(&ctx->fs_list);
     pending_fd_clear(ctx);
@@ -1248,6 +1284,121 @@ pyfanotify_response(PyObject *self, PyObject *args, PyObject *kwargs)
     Py_RETURN_NONE;
 }
 
+PyDoc_STRVAR(response_batch__doc__,
+"response_batch(ctx: int, fanotify_fd: int, responses: Iterable[Tuple[int, int]][, log_fd: int]) -> None\n"
+"\n"
+"Send responses to several permission events. Responses are written\n"
+"with writev(), one iovec per struct fanotify_response. All responses are\n"
+"validated before anything is written; a response that fails to write is\n"
+"skipped and the rest are still sent.\n"
+"\n"
+"Args:\n"
+"    ctx (int): Fanotify context\n"
+"    fanotify_fd (int): Fanotify file descriptor (from fanotify_init)\n"
+"    responses (Iterable[Tuple[int, int]]): Pairs of (event_fd, response)\n"
+"    log_fd (int): Optional\n"
+"\n"
+"Raises:\n"
+"    OSError: if any response failed to write (after sending the others)\n"
+"    TypeError: if a response is not an (event_fd, response) pair\n"
+"    ValueError: if invalid response value\n");
+
+static PyObject *
+pyfanotify_response_batch(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = {"ctx", "fanotify_fd", "responses", "log_fd", NULL};
+    long long ctx_ptr;
+    int fanotify_fd, log_fd = -1;
+    PyObject *responses, *seq;
+    fano_ctx_t *ctx;
+    struct fanotify_response *fan_responses;
+    struct iovec iov[RESPONSE_BATCH_SIZE];
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "LiO|i:response_batch", kwlist,
+                                     &ctx_ptr, &fanotify_fd, &responses, &log_fd))
+        return NULL;
+
+    if (!(ctx = (void *)ctx_ptr)) {
+        PyErr_SetString(PyExc_ValueError, "Invalid context");
+        return NULL;
+    }
+
+    ctx->log_fd = log_fd;
+
+    if (!(seq = PySequence_Fast(responses, "'responses' must be iterable")))
+        return NULL;
+
+    Py_ssize_t total = PySequence_Fast_GET_SIZE(seq);
+    PyObject **items = PySequence_Fast_ITEMS(seq);
+
+    if (!(fan_responses = PyMem_New(struct fanotify_response, total))) {
+        Py_DECREF(seq);
+        return PyErr_NoMemory();
+    }
+
+    // parse and validate everything first: nothing may be written if any entry is bad
+    for (Py_ssize_t i = 0; i < total; ++i) {
+        int event_fd;
+        unsigned int response;
+        if (!PyArg_Parse(items[i], "(iI):response_batch", &event_fd, &response))
+            goto error;
+        if (response != FAN_ALLOW && response != FAN_DENY && response != FAN_AUDIT) {
+            PyErr_Format(PyExc_ValueError,
+                         "Invalid response: %u. Must be FAN_ALLOW (%u), FAN_DENY (%u), or FAN_AUDIT (%u)",
+                         response, FAN_ALLOW, FAN_DENY, FAN_AUDIT);
+            goto error;
+        }
+        fan_responses[i] = (struct fanotify_response){.fd = event_fd, .response = response};
+    }
+
+    Py_ssize_t failed = 0;
+    int failed_fd = -1, failed_errno = 0;
+    for (Py_ssize_t off = 0; off < total; off += RESPONSE_BATCH_SIZE) {
+        int cnt = (total - off < RESPONSE_BATCH_SIZE) ? (int)(total - off) : RESPONSE_BATCH_SIZE;
+        for (int i = 0; i < cnt; ++i)
+            iov[i] = (struct iovec){&fan_responses[off + i], sizeof(*fan_responses)};
+
+        // fanotify takes one response per write; writev() loops over the iovecs
+        // and stops at the first one that fails: skip it and send the rest
+        for (int start = 0; start < cnt;) {
+            ssize_t ret = writev(fanotify_fd, &iov[start], cnt - start);
+            if (ret == -1) {
+                if (errno == EINTR)
+                    continue;
+                if (!failed++) {
+                    failed_fd = fan_responses[off + start].fd;
+                    failed_errno = errno;
+                }
+                ++start;
+            } else
+                start += ret / sizeof(*fan_responses);
+        }
+    }
+
+    if (failed) {
+        PyObject *msg = PyUnicode_FromFormat("Failed to send %zd of %zd responses (first event_fd %d): %s",
+                                             failed, total, failed_fd, strerror(failed_errno));
+        if (msg) {
+            PyObject *exc = PyObject_CallFunction(PyExc_OSError, "iO", failed_errno, msg);
+            if (exc) {
+                PyErr_SetObject(PyExc_OSError, exc);
+                Py_DECREF(exc);
+            }
+            Py_DECREF(msg);
+        }
+        goto error;
+    }
+
+    PyMem_Free(fan_responses);
+    Py_DECREF(seq);
+    Py_RETURN_NONE;
+
+error:
+    PyMem_Free(fan_responses);
+    Py_DECREF(seq);
+    return NULL;
+}
+
 
 static PyMethodDef ext_methods[] = {
         {"create", (PyCFunction)pyfanotify_create, METH_NOARGS, create__doc__},
@@ -1255,6 +1406,7 @@ static PyMethodDef ext_methods[] = {
         {"mark", (PyCFunction)pyfanotify_mark, METH_VARARGS | METH_KEYWORDS, mark__doc__},
         {"run", (PyCFunction)pyfanotify_run, METH_VARARGS | METH_KEYWORDS, run__doc__},
         {"response", (PyCFunction)pyfanotify_response, METH_VARARGS | METH_KEYWORDS, response__doc__},
+        {"response_batch", (PyCFunction)pyfanotify_response_batch, METH_VARARGS | METH_KEYWORDS, response_batch__doc__},
         {NULL, NULL, 0, NULL}
 };
 